@@ -4,14 +4,39 @@ MQTT Cover device implementation for Homeassistant autodiscovery.
 #  Copyright (c) 2023 Tobias Jaehnel, Ulrich Frank
 #  This code is published under the MIT license
 
-import threading
-from typing import Callable, Optional
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from paho.mqtt.client import Client, MQTTMessage
+from paho.mqtt.client import Client, MQTTMessage, PayloadType
 
 from ha_mqtt import mqtt_device_base
 from ha_mqtt.util import HaCoverDeviceClass
 from ha_mqtt.mqtt_device_base import MqttDeviceSettings
+from mqtt_publish_queue import PAYLOAD_AVAILABLE, PAYLOAD_NOT_AVAILABLE, flush_and_go_offline, queue_publish
+
+# Encoded position payloads, indexed by position in percent
+_POSITION_PAYLOADS = tuple(str(position).encode() for position in range(101))
+
+
+def _noop(*args: Any, **kwargs: Any) -> None:
+    """Default callback for commands the application does not handle."""
+
+
+# Command topics waiting to be subscribed with a single SUBSCRIBE packet
+_PENDING_SUBS: List[Tuple[str, int]] = []
+
+
+def flush_subscriptions(client: Client) -> None:
+    """Subscribe to all pending command topics in one request.
+
+    Call this once after all covers have run their pre_discovery.
+
+    Args:
+        client: MQTT client to subscribe with
+    """
+    if _PENDING_SUBS:
+        client.subscribe(list(_PENDING_SUBS))
+        _PENDING_SUBS.clear()
 
 
 class MqttCover(mqtt_device_base.MqttDeviceBase):
@@ -19,7 +44,7 @@ class MqttCover(mqtt_device_base.MqttDeviceBase):
     MQTT Cover device for Homeassistant integration.
 
     Implements cover with open/close/stop/position controls and callbacks
-    that execute in separate threads.
+    that execute in the MQTT network loop.
 
     Attributes:
         callback_open: Called when OPEN command received
@@ -28,11 +53,18 @@ class MqttCover(mqtt_device_base.MqttDeviceBase):
         callback_position: Called with position (0-100) when position command received
     
     Warning:
-        Callbacks run in separate threads. Ensure thread-safety in implementations.
+        Callbacks run in the MQTT network loop and must not block.
     """
 
     device_type = "cover"
 
+    # Maps command payloads to the name of the callback attribute to run
+    _COMMAND_CALLBACKS: Dict[bytes, str] = {
+        b'OPEN': "callback_open",
+        b'CLOSE': "callback_close",
+        b'STOP': "callback_stop",
+    }
+
     def __init__(
         self,
         settings: MqttDeviceSettings,
@@ -47,10 +79,10 @@ class MqttCover(mqtt_device_base.MqttDeviceBase):
             inverse_position: If True, invert open/close behavior
         """
         # Callbacks that will be set by the application
-        self.callback_open: Callable[[], None] = lambda: None
-        self.callback_close: Callable[[], None] = lambda: None
-        self.callback_stop: Callable[[], None] = lambda: None
-        self.callback_position: Callable[[int], None] = lambda position: None
+        self.callback_open: Callable[[], None] = _noop
+        self.callback_close: Callable[[], None] = _noop
+        self.callback_stop: Callable[[], None] = _noop
+        self.callback_position: Callable[[int], None] = _noop
         
         self.command_topic: str = ""
         self.position_topic: str = ""
@@ -63,18 +95,17 @@ class MqttCover(mqtt_device_base.MqttDeviceBase):
         """Unsubscribe and cleanup."""
         if self.command_topic:
             self._client.unsubscribe(self.command_topic)
-        super().stop()
+        flush_and_go_offline(super().stop)
 
     def pre_discovery(self) -> None:
         """Configure MQTT topics and device class for Homeassistant discovery."""
         self.position_topic = f"{self.base_topic}/position"
         self.command_topic = f"{self.base_topic}/set"
-        availability_topic = f"{self.base_topic}/available"
 
         self.add_config_option("position_topic", self.position_topic)
         self.add_config_option("command_topic", self.command_topic)
         self.add_config_option("set_position_topic", self.command_topic)
-        self.add_config_option("availability_topic", availability_topic)
+        self.add_config_option("availability_topic", self.avail_topic)
         self.add_config_option("payload_available", "online")
         self.add_config_option("payload_not_available", "offline")
         
@@ -87,7 +118,7 @@ class MqttCover(mqtt_device_base.MqttDeviceBase):
         
         self.add_config_option("device_class", self.device_class.value)
 
-        self._client.subscribe(self.command_topic)
+        _PENDING_SUBS.append((self.command_topic, 0))
         self._client.message_callback_add(self.command_topic, self.command_callback)
 
     def publish_position(self, position: int, retain: bool = True) -> None:
@@ -97,8 +128,19 @@ class MqttCover(mqtt_device_base.MqttDeviceBase):
             position: Position in percent (0-100)
             retain: Whether to retain the message
         """
-        self._logger.debug(f"Publishing position {position}% for {self._unique_id}")
-        self._client.publish(self.position_topic, str(position), retain=retain)
+        self._logger.debug("Publishing position %s%% for %s", position, self._unique_id)
+        payload = _POSITION_PAYLOADS[position] if 0 <= position <= 100 else str(position)
+        queue_publish(self._client, self.position_topic, payload, retain)
+
+    def update_state(self, payload: PayloadType, retain: bool = True) -> None:
+        """Publish cover state to MQTT.
+
+        Args:
+            payload: State (open, opening, closing or closed)
+            retain: Whether to retain the message
+        """
+        self._logger.debug("Publishing state %s for %s", payload, self._unique_id)
+        queue_publish(self._client, self.state_topic, payload, retain)
 
     def publish_availability(self, available: bool = True) -> None:
         """Publish device availability status to MQTT.
@@ -106,10 +148,8 @@ class MqttCover(mqtt_device_base.MqttDeviceBase):
         Args:
             available: True for online, False for offline
         """
-        availability_topic = f"{self.base_topic}/available"
-        status = "online" if available else "offline"
-        self._logger.debug(f"Publishing availability {status} for {self._unique_id}")
-        self._client.publish(availability_topic, status, retain=True)
+        self._logger.debug("Publishing availability %s for %s", "online" if available else "offline", self._unique_id)
+        queue_publish(self._client, self.avail_topic, PAYLOAD_AVAILABLE if available else PAYLOAD_NOT_AVAILABLE)
 
     def command_callback(
         self,
@@ -125,57 +165,30 @@ class MqttCover(mqtt_device_base.MqttDeviceBase):
             msg: MQTT message with command payload
         """
         payload = msg.payload
-        payload_str = payload.decode("utf-8") if isinstance(payload, bytes) else str(payload)
-        self._logger.debug(f"Received command {payload_str} for {self._unique_id}")
-        
+        if self._logger.isEnabledFor(logging.DEBUG):
+            payload_str = payload.decode("utf-8", errors="replace") if isinstance(payload, bytes) else str(payload)
+            self._logger.debug("Received command %s for %s", payload_str, self._unique_id)
+
         try:
-            if payload == b'OPEN':
-                threading.Thread(
-                    target=self.callback_open,
-                    name="mqtt_callback_open",
-                    daemon=True
-                ).start()
-            elif payload == b'CLOSE':
-                threading.Thread(
-                    target=self.callback_close,
-                    name="mqtt_callback_close",
-                    daemon=True
-                ).start()
-            elif payload == b'STOP':
-                threading.Thread(
-                    target=self.callback_stop,
-                    name="mqtt_callback_stop",
-                    daemon=True
-                ).start()
-            else:
-                # Try to parse as position
-                try:
-                    position = int(payload)
-                    if 0 <= position <= 100:
-                        threading.Thread(
-                            target=self.callback_position,
-                            args=(position,),
-                            name="mqtt_callback_position",
-                            daemon=True
-                        ).start()
-                    else:
-                        self._logger.error(
-                            f"Invalid position {position} for {self._unique_id} (must be 0-100)"
-                        )
-                except ValueError:
+            callback_name = self._COMMAND_CALLBACKS.get(payload)
+            if callback_name is not None:
+                getattr(self, callback_name)()
+            elif payload.isdigit() and len(payload) <= 3:
+                position = int(payload)
+                if position <= 100:
+                    self.callback_position(position)
+                else:
                     self._logger.error(
-                        f"Unknown command '{payload.decode('utf-8', errors='replace')}' "
-                        f"for {self._unique_id}"
+                        "Invalid position %s for %s (must be 0-100)", position, self._unique_id
                     )
-        except (ValueError, TypeError) as e:
+            else:
+                self._logger.error(
+                    "Unknown command '%s' for %s", payload.decode("utf-8", errors="replace"), self._unique_id
+                )
+        except Exception:
             payload_str = payload.decode("utf-8", errors="replace") if isinstance(payload, bytes) else str(payload)
+            # Formatting tracebacks is expensive, only do it when debugging
             self._logger.error(
-                f"Invalid command payload '{payload_str}' for {self._unique_id}: {e}",
-                exc_info=True
-            )
-        except Exception as e:
-            payload_str = payload.decode("utf-8", errors="replace") if isinstance(payload, bytes) else str(payload)
-            self._logger.exception(
-                f"Unexpected error processing command '{payload_str}' for {self._unique_id}"
+                "Unexpected error processing command '%s' for %s", payload_str, self._unique_id,
+                exc_info=self._logger.isEnabledFor(logging.DEBUG)
             )
- 
\ No newline at end of file
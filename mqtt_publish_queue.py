@@ -0,0 +1,93 @@
+"""
+Coalescing publish queue for frequently updated MQTT topics.
+"""
+#  Copyright (c) 2023 Tobias Jaehnel, Ulrich Frank
+#  This code is published under the MIT license
+
+import asyncio
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+from paho.mqtt.client import Client, PayloadType
+
+PUBLISH_FLUSH_INTERVAL = 0.02  # Seconds to collect updates before publishing
+
+PAYLOAD_AVAILABLE = b"online"
+PAYLOAD_NOT_AVAILABLE = b"offline"
+
+_logger = logging.getLogger(__name__)
+
+# Pending publishes keyed by topic; a newer payload replaces an older one
+# that has not been sent yet. Only accessed from the event loop thread.
+_pending: Dict[str, Tuple[Client, PayloadType, bool]] = {}
+_flush_handle: Optional[asyncio.TimerHandle] = None
+_paused = False
+
+
+def queue_publish(client: Client, topic: str, payload: PayloadType, retain: bool = True) -> None:
+    """Queue a publish, superseding any pending payload for the same topic.
+
+    Must be called from the event loop thread. Without a running event
+    loop the payload is published right away.
+
+    Args:
+        client: MQTT client to publish with
+        topic: Topic to publish to
+        payload: Payload to publish
+        retain: Whether to retain the message
+    """
+    global _flush_handle
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _pending.pop(topic, None)
+        client.publish(topic, payload, retain=retain)
+        return
+
+    _pending[topic] = (client, payload, retain)
+    if _flush_handle is None:
+        _flush_handle = loop.call_later(PUBLISH_FLUSH_INTERVAL, flush_publishes)
+
+
+def flush_publishes() -> None:
+    """Publish all pending payloads immediately, unless publishing is paused."""
+    global _flush_handle
+    if _flush_handle is not None:
+        _flush_handle.cancel()
+        _flush_handle = None
+    if _paused:
+        return
+
+    pending = _pending.copy()
+    _pending.clear()
+    for topic, (client, payload, retain) in pending.items():
+        try:
+            client.publish(topic, payload, retain=retain)
+        except Exception as e:
+            _logger.error("Error publishing to %s: %s", topic, e)
+
+
+def flush_and_go_offline(go_offline: Callable[[], None]) -> None:
+    """Publish all pending payloads, then report a device offline.
+
+    Flushing first makes sure a queued 'online' cannot be sent after
+    the 'offline'.
+
+    Args:
+        go_offline: Reports the device offline, e.g. MqttDeviceBase.stop
+    """
+    flush_publishes()
+    go_offline()
+
+
+def pause_publishes() -> None:
+    """Hold back queued publishes, e.g. while the client is reconnecting."""
+    global _paused
+    _paused = True
+
+
+def resume_publishes() -> None:
+    """Publish everything held back since pause_publishes()."""
+    global _paused
+    _paused = False
+    flush_publishes()
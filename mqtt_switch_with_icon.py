@@ -4,10 +4,13 @@ MQTT switch with custom icon for Homeassistant autodiscovery.
 #  Copyright (c) 2023 Tobias Jaehnel, Ulrich Frank
 #  This code is published under the MIT license
 
-from typing import Optional
+from paho.mqtt.client import PayloadType
 
 from ha_mqtt.mqtt_switch import MqttSwitch
 from ha_mqtt.mqtt_device_base import MqttDeviceSettings
+from mqtt_publish_queue import PAYLOAD_AVAILABLE, PAYLOAD_NOT_AVAILABLE, flush_and_go_offline, queue_publish
+
+__all__ = ["MqttSwitchWithIcon"]
 
 
 class MqttSwitchWithIcon(MqttSwitch):
@@ -27,21 +30,31 @@ class MqttSwitchWithIcon(MqttSwitch):
         self.icon: str = icon
         super().__init__(settings)
 
+    def stop(self) -> None:
+        """Unsubscribe and cleanup."""
+        flush_and_go_offline(super().stop)
+
     def pre_discovery(self) -> None:
         """Configure icon and availability for Homeassistant discovery."""
         self.add_config_option("icon", self.icon)
-        availability_topic = f"{self.base_topic}/available"
-        self.add_config_option("availability_topic", availability_topic)
+        self.add_config_option("availability_topic", self.avail_topic)
         self.add_config_option("payload_available", "online")
         self.add_config_option("payload_not_available", "offline")
         super().pre_discovery()
 
+    def update_state(self, payload: PayloadType, retain: bool = True) -> None:
+        """Publish switch state to MQTT.
+
+        Args:
+            payload: State (on or off)
+            retain: Whether to retain the message
+        """
+        queue_publish(self._client, self.state_topic, payload, retain)
+
     def publish_availability(self, available: bool = True) -> None:
         """Publish device availability status to MQTT.
         
         Args:
             available: True for online, False for offline
         """
-        availability_topic = f"{self.base_topic}/available"
-        status = "online" if available else "offline"
-        self._client.publish(availability_topic, status, retain=True)
+        queue_publish(self._client, self.avail_topic, PAYLOAD_AVAILABLE if available else PAYLOAD_NOT_AVAILABLE)
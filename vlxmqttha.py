@@ -7,6 +7,7 @@ KLF200 to MQTT bridge application for Homeassistant integration.
 
 import os
 import sys
+import queue
 import signal
 import logging
 import configparser
@@ -15,18 +16,26 @@ from paho.mqtt.client import CallbackAPIVersion  # type: ignore[attr-defined]
 import argparse
 import asyncio
 import time
-from threading import Semaphore, Lock
+import functools
+import traceback
 from pathlib import Path
-from typing import Optional, Dict, Coroutine, Any
+from typing import Optional, Dict, List, Callable, Coroutine, Any
 from contextlib import asynccontextmanager
 
+try:
+    import uvloop
+    HAS_UVLOOP = True
+except ImportError:  # Not available e.g. on Windows, use the stdlib loop
+    HAS_UVLOOP = False
+
 from pyvlx import Position, PyVLX, OpeningDevice, Window, Blind, Awning, RollerShutter, GarageDoor, Gate, Blade  # type: ignore[attr-defined]
 from pyvlx.log import PYVLXLOG
 
 from ha_mqtt.ha_device import HaDevice
 from ha_mqtt.mqtt_device_base import MqttDeviceSettings
 from ha_mqtt.util import HaCoverDeviceClass
-from mqtt_cover import MqttCover
+from mqtt_cover import MqttCover, flush_subscriptions
+from mqtt_publish_queue import pause_publishes, resume_publishes
 from mqtt_switch_with_icon import MqttSwitchWithIcon
 
 parser = argparse.ArgumentParser(
@@ -45,28 +54,26 @@ def load_config(config_file: str) -> configparser.RawConfigParser:
     if not files_read:
         raise FileNotFoundError(f"Config file not found: {config_file}")
     
-    # Validate required sections
-    required_sections = ["mqtt", "velux"]
-    for section in required_sections:
-        if not config.has_section(section):
-            raise ValueError(f"Missing required config section: [{section}]")
-    
-    # Validate required options
+    # Validate required sections and options
     required_options = {
-        "mqtt": ["host", "port"],
-        "velux": ["host", "password"]
+        "mqtt": {"host", "port"},
+        "velux": {"host", "password"}
     }
+    missing_sections = required_options.keys() - set(config.sections())
+    if missing_sections:
+        raise ValueError(f"Missing required config section: [{min(missing_sections)}]")
+    
     for section, options in required_options.items():
-        for option in options:
-            if not config.has_option(section, option):
-                raise ValueError(f"Missing required option {option} in section [{section}]")
+        missing_options = options - set(config.options(section))
+        if missing_options:
+            raise ValueError(f"Missing required option {min(missing_options)} in section [{section}]")
     
     return config
 
 try:
     config = load_config(args.config_file)
 except (FileNotFoundError, ValueError) as e:
-    logging.error(f"Configuration error: {e}")
+    logging.error("Configuration error: %s", e)
     sys.exit(1)
 
 # [mqtt]
@@ -77,6 +84,7 @@ MQTT_PASSWORD: Optional[str] = config.get("mqtt", "password", fallback=None)
 # [homeassistant]
 HA_PREFIX: str = config.get("homeassistant", "prefix", fallback="")
 HA_INVERT_AWNING: bool = config.getboolean("homeassistant", "invert_awning", fallback=False)
+HA_STATE_UPDATE_INTERVAL: int = config.getint("homeassistant", "state_update_interval", fallback=60)
 # [velux]
 VLX_HOST: str = config.get("velux", "host")
 VLX_PW: str = config.get("velux", "password")
@@ -91,68 +99,78 @@ RESTART_ON_ERROR: bool = config.getboolean("restart", "restart_on_error", fallba
 
 APPNAME = "vlxmqttha"
 HEALTH_CHECK_FAILURE_THRESHOLD = 2.0  # Times health check interval
+HEALTH_CHECK_MAX_SILENCE = HEALTH_CHECK_INTERVAL * HEALTH_CHECK_FAILURE_THRESHOLD  # Seconds
 
-# Logging setup with rotation support
-from logging.handlers import RotatingFileHandler
+# Logging setup with rotation support. Handlers run on a listener thread
+# so log I/O does not block the event loop or the MQTT callbacks.
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 LOGFORMAT = '%(asctime)-15s %(message)s'
 
 loglevel = logging.DEBUG if VERBOSE else logging.INFO
 pyvlxLogLevel = logging.DEBUG if KLF200LOG else logging.INFO
 
+handler: logging.Handler
 if LOGFILE:
     handler = RotatingFileHandler(
         LOGFILE,
         maxBytes=10 * 1024 * 1024,  # 10MB
         backupCount=5
     )
-    handler.setFormatter(logging.Formatter(LOGFORMAT))
     handler.setLevel(loglevel)
-    logging.getLogger().addHandler(handler)
-    logging.getLogger().setLevel(loglevel)
 else:
-    logging.basicConfig(stream=sys.stdout, format=LOGFORMAT, level=loglevel)
+    handler = logging.StreamHandler(sys.stdout)
+handler.setFormatter(logging.Formatter(LOGFORMAT))
 
-logging.info(f"Starting {APPNAME}")
-logging.debug(f"Configuration loaded: VERBOSE={VERBOSE}, KLF200LOG={KLF200LOG}")
-
-PYVLXLOG.setLevel(pyvlxLogLevel)
+# KLF200 communication is additionally logged to stdout
 ch = logging.StreamHandler(sys.stdout)
 ch.setLevel(pyvlxLogLevel)
-PYVLXLOG.addHandler(ch)
+ch.addFilter(logging.Filter(PYVLXLOG.name))
 
-# Global state management with thread safety
-klf_command_semaphore: Semaphore = Semaphore(2)
-state_lock: Lock = Lock()
+log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, handler, ch, respect_handler_level=True)
+log_listener.start()
+logging.getLogger().addHandler(QueueHandler(log_queue))
+logging.getLogger().setLevel(loglevel)
 
-_last_successful_klf_contact: float = time.time()
-_last_restart_time: float = time.time()
+logging.info("Starting %s", APPNAME)
+logging.debug("Configuration loaded: VERBOSE=%s, KLF200LOG=%s", VERBOSE, KLF200LOG)
 
-def call_async_blocking(coroutine: Coroutine[Any, Any, Any]) -> None:
-    """Execute async coroutine in blocking manner with semaphore protection."""
-    klf_command_semaphore.acquire()
-    try:
-        future = asyncio.run_coroutine_threadsafe(coroutine, LOOP)
-        future.result(timeout=30)  # Add timeout to prevent hanging
-    except asyncio.TimeoutError:
-        logging.error("KLF200 command timed out after 30 seconds")
-    except Exception as e:
-        logging.error(f"KLF200 command error: {e}", exc_info=True)
-    finally:
-        klf_command_semaphore.release()
+PYVLXLOG.setLevel(pyvlxLogLevel)
+
+# Global state management
+KLF_MAX_CONCURRENT_COMMANDS = 2
+KLF_COMMAND_TIMEOUT = 30  # Seconds
+MQTT_RECONNECT_DELAY = 10  # Seconds
+
+_last_restart_time: float = time.monotonic()
+
+
+def trigger_restart(homeassistant_instance: "VeluxMqttHomeassistant") -> None:
+    """Trigger application restart by stopping the application."""
+    logging.info("Stopping application to trigger restart")
+    homeassistant_instance.stop()
+
+
+# Homeassistant cover device class for each VLX device type
+_DEVICE_CLASS_MAP: Dict[type, HaCoverDeviceClass] = {
+    Window: HaCoverDeviceClass.WINDOW,
+    Blind: HaCoverDeviceClass.BLIND,
+    Awning: HaCoverDeviceClass.AWNING,
+    RollerShutter: HaCoverDeviceClass.SHUTTER,
+    GarageDoor: HaCoverDeviceClass.GARAGE,
+    Gate: HaCoverDeviceClass.GATE,
+    Blade: HaCoverDeviceClass.SHADE,
+}
 
+_UMLAUT_TRANS = str.maketrans({'ä': 'ae', 'ü': 'ue', 'ö': 'oe', 'ß': 'ss'})
 
-def trigger_restart() -> None:
-    """Trigger application restart by stopping the event loop."""
-    logging.info("Stopping event loop to trigger restart")
-    LOOP.call_soon_threadsafe(LOOP.stop)
 
+@functools.lru_cache(maxsize=256)
+def mqttid_from_name(name: str) -> str:
+    """Generate MQTT ID from a VLX node name."""
+    return "vlx-" + name.replace(" ", "-").lower().translate(_UMLAUT_TRANS)
 
-def record_klf_contact() -> None:
-    """Record successful contact with KLF200 (thread-safe)."""
-    global _last_successful_klf_contact
-    with state_lock:
-        _last_successful_klf_contact = time.time()
 
 class VeluxMqttCover:
     """
@@ -168,17 +186,33 @@ class VeluxMqttCover:
         haDevice: Homeassistant device representation
         coverDevice: MQTT cover entity
         limitSwitchDevice: MQTT limit switch entity
+        submit_command: Queues a KLF200 command coroutine
     """
+
+    __slots__ = (
+        'vlxnode', 'mqttc', 'mqttid', 'submit_command', 'haDevice', 'coverDevice',
+        'limitSwitchDevice', 'last_state', '_last_position', '_last_limit'
+    )
     
-    def __init__(self, mqttc: mqtt.Client, vlxnode: OpeningDevice, mqttid: str) -> None:
-        logging.debug(f"Registering {vlxnode.name} to Homeassistant (Type: {type(vlxnode).__name__})")
+    def __init__(
+        self,
+        mqttc: mqtt.Client,
+        vlxnode: OpeningDevice,
+        mqttid: str,
+        submit_command: Callable[[Coroutine[Any, Any, Any]], None]
+    ) -> None:
+        logging.debug("Registering %s to Homeassistant (Type: %s)", vlxnode.name, type(vlxnode).__name__)
         self.vlxnode: OpeningDevice = vlxnode
         self.mqttc: mqtt.Client = mqttc
         self.mqttid: str = mqttid
+        self.submit_command: Callable[[Coroutine[Any, Any, Any]], None] = submit_command
         self.haDevice: HaDevice = HaDevice(HA_PREFIX + vlxnode.name, HA_PREFIX + mqttid)
         self.coverDevice: MqttCover = self.makeMqttCover()
         self.limitSwitchDevice: MqttSwitchWithIcon = self.makeMqttKeepOpenSwitch()
-        self.last_state: Optional[str] = None  # Track last state to detect changes
+        # Last published values, to skip publishing unchanged state
+        self.last_state: Optional[str] = None
+        self._last_position: Optional[int] = None
+        self._last_limit: Optional[str] = None
     
     def makeMqttCover(self) -> MqttCover:
         """Create MQTT cover device with appropriate device class."""
@@ -196,21 +230,12 @@ class VeluxMqttCover:
 
     def getHaDeviceClassFromVlxNode(self, vlxnode: OpeningDevice) -> HaCoverDeviceClass:
         """Map VLX device type to Homeassistant cover device class."""
-        device_class_map = {
-            Window: HaCoverDeviceClass.WINDOW,
-            Blind: HaCoverDeviceClass.BLIND,
-            Awning: HaCoverDeviceClass.AWNING,
-            RollerShutter: HaCoverDeviceClass.SHUTTER,
-            GarageDoor: HaCoverDeviceClass.GARAGE,
-            Gate: HaCoverDeviceClass.GATE,
-            Blade: HaCoverDeviceClass.SHADE,
-        }
-        
-        for device_type, ha_class in device_class_map.items():
-            if isinstance(vlxnode, device_type):
+        for cls in type(vlxnode).__mro__:
+            ha_class = _DEVICE_CLASS_MAP.get(cls)
+            if ha_class is not None:
                 return ha_class
-        
-        logging.warning(f"Unknown device type: {type(vlxnode).__name__}, defaulting to NONE")
+
+        logging.warning("Unknown device type: %s, defaulting to NONE", type(vlxnode).__name__)
         return HaCoverDeviceClass.NONE
         
     async def registerMqttCallbacks(self) -> None:
@@ -232,12 +257,18 @@ class VeluxMqttCover:
         
     def updateNode(self) -> None:
         """Callback for node state changes from KLF200."""
-        logging.debug(f"Updating {self.vlxnode.name}")
+        logging.debug("Updating %s", self.vlxnode.name)
         self.updateCover()
         self.updateLimitSwitch()
         # Publish online status when node is updated
         self.coverDevice.publish_availability(True)
         self.limitSwitchDevice.publish_availability(True)
+
+    def forget_published_state(self) -> None:
+        """Forget the last published values, so the next update publishes everything again."""
+        self.last_state = None
+        self._last_position = None
+        self._last_limit = None
         
     def updateCover(self) -> None:
         """Update cover state based on VLX node."""
@@ -247,15 +278,13 @@ class VeluxMqttCover:
         # Ensure position is in valid range (0-100)
         # If out of range, use current position as fallback
         if position < 0 or position > 100:
-            logging.warning(f"{self.vlxnode.name}: Invalid position {position}, using fallback")
+            logging.warning("%s: Invalid position %s, using fallback", self.vlxnode.name, position)
             position = 0
             
         if target_position < 0 or target_position > 100:
-            logging.debug(f"{self.vlxnode.name}: Invalid target position {target_position}, assuming stopped at {position}")
+            logging.debug("%s: Invalid target position %s, assuming stopped at %s", self.vlxnode.name, target_position, position)
             target_position = position
 
-        self.coverDevice.publish_position(position)
-        
         # Determine state based on position and target position
         # First check if we're at the target position (stopped)
         if position == target_position:
@@ -273,14 +302,14 @@ class VeluxMqttCover:
             # Fallback (shouldn't reach here)
             mqtt_state = "open"
         
-        # Always update state to ensure it reflects current conditions
-        # This prevents state from getting stuck
+        if position == self._last_position and mqtt_state == self.last_state:
+            return
+        self._last_position = position
+        self.last_state = mqtt_state
+
+        self.coverDevice.publish_position(position)
         self.coverDevice.update_state(mqtt_state)
-        if mqtt_state != self.last_state:
-            self.last_state = mqtt_state
-            logging.debug(f"{self.vlxnode.name}: position={position}%, target={target_position}%, state={mqtt_state}")
-        else:
-            logging.debug(f"{self.vlxnode.name}: position={position}%, target={target_position}%, state={mqtt_state} (unchanged)")
+        logging.debug("%s: position=%s%%, target=%s%%, state=%s", self.vlxnode.name, position, target_position, mqtt_state)
 
     def updateLimitSwitch(self) -> None:
         """Update keep-open switch state."""
@@ -288,31 +317,35 @@ class VeluxMqttCover:
             # limitation_max shows the upper limit position
             # If limitation is set (not IgnorePosition), switch is 'on'
             max_position = self.vlxnode.limitation_max.position_percent
-            self.limitSwitchDevice.update_state('on' if max_position < 100 else 'off')
+            limit_state = 'on' if max_position < 100 else 'off'
         except (AttributeError, ValueError):
             # If limitation_max is not properly set, assume fully open
-            logging.debug(f"limitation_max not available or invalid for {self.vlxnode.name}")
-            self.limitSwitchDevice.update_state('off')
+            logging.debug("limitation_max not available or invalid for %s", self.vlxnode.name)
+            limit_state = 'off'
+
+        if limit_state != self._last_limit:
+            self._last_limit = limit_state
+            self.limitSwitchDevice.update_state(limit_state)
                 
     def mqtt_callback_open(self) -> None:
         """Handle MQTT open command."""
-        logging.debug(f"Opening {self.vlxnode.name}")
-        call_async_blocking(self.vlxnode.open(wait_for_completion=False))  # type: ignore[no-untyped-call]
+        logging.debug("Opening %s", self.vlxnode.name)
+        self.submit_command(self.vlxnode.open(wait_for_completion=False))  # type: ignore[no-untyped-call]
 
     def mqtt_callback_close(self) -> None:
         """Handle MQTT close command."""
-        logging.debug(f"Closing {self.vlxnode.name}")
-        call_async_blocking(self.vlxnode.close(wait_for_completion=False))  # type: ignore[no-untyped-call]
+        logging.debug("Closing %s", self.vlxnode.name)
+        self.submit_command(self.vlxnode.close(wait_for_completion=False))  # type: ignore[no-untyped-call]
 
     def mqtt_callback_stop(self) -> None:
         """Handle MQTT stop command."""
-        logging.debug(f"Stopping {self.vlxnode.name}")
-        call_async_blocking(self.vlxnode.stop(wait_for_completion=False))  # type: ignore[no-untyped-call]
+        logging.debug("Stopping %s", self.vlxnode.name)
+        self.submit_command(self.vlxnode.stop(wait_for_completion=False))  # type: ignore[no-untyped-call]
 
     def mqtt_callback_position(self, position: int) -> None:
         """Handle MQTT position command."""
-        logging.debug(f"Moving {self.vlxnode.name} to position {position}%")
-        call_async_blocking(
+        logging.debug("Moving %s to position %s%%", self.vlxnode.name, position)
+        self.submit_command(
             self.vlxnode.set_position(  # type: ignore[no-untyped-call]
                 Position(position_percent=int(position)),  # type: ignore[no-untyped-call]
                 wait_for_completion=False
@@ -321,31 +354,25 @@ class VeluxMqttCover:
 
     def mqtt_callback_keepopen_on(self) -> None:
         """Enable keep-open limitation."""
-        logging.debug(f"Enable 'keep open' limitation of {self.vlxnode.name}")
-        try:
-            call_async_blocking(
-                self.vlxnode.set_position_limitations(  # type: ignore[no-untyped-call]
-                    position_min=Position(position_percent=0),  # type: ignore[no-untyped-call]
-                    position_max=Position(position_percent=0)  # type: ignore[no-untyped-call]
-                )
+        logging.debug("Enable 'keep open' limitation of %s", self.vlxnode.name)
+        self.submit_command(
+            self.vlxnode.set_position_limitations(  # type: ignore[no-untyped-call]
+                position_min=Position(position_percent=0),  # type: ignore[no-untyped-call]
+                position_max=Position(position_percent=0)  # type: ignore[no-untyped-call]
             )
-        except Exception as e:
-            logging.warning(f"Failed to set position limitations: {e}")
+        )
 
     def mqtt_callback_keepopen_off(self) -> None:
         """Disable keep-open limitation."""
-        logging.debug(f"Disable 'keep open' limitation of {self.vlxnode.name}")
-        try:
-            call_async_blocking(self.vlxnode.clear_position_limitations())  # type: ignore[no-untyped-call]
-        except Exception as e:
-            logging.warning(f"Failed to clear position limitations: {e}")
+        logging.debug("Disable 'keep open' limitation of %s", self.vlxnode.name)
+        self.submit_command(self.vlxnode.clear_position_limitations())  # type: ignore[no-untyped-call]
 
     def close(self) -> None:
         """Properly close and cleanup device."""
         try:
             self.coverDevice.stop()
         except Exception as e:
-            logging.error(f"Error closing cover device {self.vlxnode.name}: {e}", exc_info=True)
+            logging.error("Error closing cover device %s: %s", self.vlxnode.name, e, exc_info=True)
 
     def stop(self) -> None:
         """Alias for close() for compatibility."""
@@ -360,6 +387,8 @@ class VeluxMqttCover:
 
 class VeluxMqttCoverInverted(VeluxMqttCover):
     """Inverted cover (e.g., awnings that work opposite to shutters)."""
+
+    __slots__ = ()
     
     def makeMqttCover(self) -> MqttCover:
         """Create MQTT cover with inverted position."""
@@ -371,13 +400,13 @@ class VeluxMqttCoverInverted(VeluxMqttCover):
 
     def mqtt_callback_open(self) -> None:
         """Handle inverted open (closes device)."""
-        logging.debug(f"Opening {self.vlxnode.name} (inverted)")
-        call_async_blocking(self.vlxnode.close(wait_for_completion=False))  # type: ignore[no-untyped-call]
+        logging.debug("Opening %s (inverted)", self.vlxnode.name)
+        self.submit_command(self.vlxnode.close(wait_for_completion=False))  # type: ignore[no-untyped-call]
 
     def mqtt_callback_close(self) -> None:
         """Handle inverted close (opens device)."""
-        logging.debug(f"Closing {self.vlxnode.name} (inverted)")
-        call_async_blocking(self.vlxnode.open(wait_for_completion=False))  # type: ignore[no-untyped-call]
+        logging.debug("Closing %s (inverted)", self.vlxnode.name)
+        self.submit_command(self.vlxnode.open(wait_for_completion=False))  # type: ignore[no-untyped-call]
 
     def updateCover(self) -> None:
         """Update cover with inverted state."""
@@ -387,15 +416,13 @@ class VeluxMqttCoverInverted(VeluxMqttCover):
         # Ensure position is in valid range (0-100)
         # If out of range, use current position as fallback
         if position < 0 or position > 100:
-            logging.warning(f"{self.vlxnode.name}: Invalid position {position}, using fallback")
+            logging.warning("%s: Invalid position %s, using fallback", self.vlxnode.name, position)
             position = 0
             
         if target_position < 0 or target_position > 100:
-            logging.debug(f"{self.vlxnode.name}: Invalid target position {target_position}, assuming stopped at {position}")
+            logging.debug("%s: Invalid target position %s, assuming stopped at %s", self.vlxnode.name, target_position, position)
             target_position = position
 
-        self.coverDevice.publish_position(position)
-        
         # Determine state based on position and target position (inverted logic)
         # First check if we're at the target position (stopped)
         if position == target_position:
@@ -413,13 +440,14 @@ class VeluxMqttCoverInverted(VeluxMqttCover):
             # Fallback (shouldn't reach here)
             mqtt_state = "open"
         
-        # Always update state to ensure it reflects current conditions
+        if position == self._last_position and mqtt_state == self.last_state:
+            return
+        self._last_position = position
+        self.last_state = mqtt_state
+
+        self.coverDevice.publish_position(position)
         self.coverDevice.update_state(mqtt_state)
-        if mqtt_state != self.last_state:
-            self.last_state = mqtt_state
-            logging.debug(f"{self.vlxnode.name} (inverted): position={position}%, target={target_position}%, state={mqtt_state}")
-        else:
-            logging.debug(f"{self.vlxnode.name} (inverted): position={position}%, target={target_position}%, state={mqtt_state} (unchanged)")
+        logging.debug("%s (inverted): position=%s%%, target=%s%%, state=%s", self.vlxnode.name, position, target_position, mqtt_state)
 
 
 
@@ -427,11 +455,16 @@ class VeluxMqttCoverInverted(VeluxMqttCover):
 class VeluxMqttHomeassistant:
     """
     Manages connections to KLF200 and MQTT broker.
+
+    Used as async context manager: on exit the background tasks are
+    cancelled and awaited, then all connections are closed.
     
     Attributes:
         mqttc: MQTT client
         pyvlx: PyVLX instance for KLF200 communication
         mqttDevices: Dictionary of registered MQTT devices
+        mqttDevicesByNodeId: Registered MQTT devices by KLF200 node ID
+        last_klf_contact: Event loop time of the last successful KLF200 contact
     """
     
     def __init__(self) -> None:
@@ -439,45 +472,228 @@ class VeluxMqttHomeassistant:
         self.mqttc: mqtt.Client = mqtt.Client(CallbackAPIVersion.VERSION2, mqtt_client_id)
         self.pyvlx: Optional[PyVLX] = None
         self.mqttDevices: Dict[str, VeluxMqttCover] = {}
+        self.mqttDevicesByNodeId: Dict[int, VeluxMqttCover] = {}
+        self._cmd_queue: asyncio.Queue[Coroutine[Any, Any, Any]] = asyncio.Queue()
+        # Only written and read on the event loop thread
+        self.last_klf_contact: float = LOOP.time()
+
+        # paho's network I/O runs on the asyncio loop instead of its own thread
+        self.mqttc.on_connect = self._on_mqtt_connect
+        self.mqttc.on_socket_open = self._on_mqtt_socket_open
+        self.mqttc.on_socket_close = self._on_mqtt_socket_close
+        self.mqttc.on_socket_register_write = self._on_mqtt_socket_write_changed
+        self.mqttc.on_socket_unregister_write = self._on_mqtt_socket_write_changed
+        self._mqtt_read_sock: Any = None  # Socket currently watched for incoming data
+        self._mqtt_write_sock: Any = None  # Socket currently watched for writability
+        # Set while a worker thread owns the client for a blocking (re)connect
+        self._mqtt_connecting: bool = False
+        self._mqtt_connect_future: Optional[asyncio.Future[Any]] = None
+        self._mqtt_misc_task: Optional[asyncio.Task[None]] = None
+        self._tasks: List[asyncio.Task[None]] = []
+        self._main_task: Optional[asyncio.Task[Any]] = None
+        self._stop_requested: bool = False
+        self._closed: bool = False
+
+    async def __aenter__(self) -> "VeluxMqttHomeassistant":
+        """Remember the task running the application, so stop() can end it."""
+        self._main_task = asyncio.current_task()
+        if self._stop_requested and self._main_task is not None:
+            # stop() was called before the application was started
+            self._main_task.cancel()
+        return self
+
+    async def __aexit__(self, exc_type: Optional[type], exc: Optional[BaseException], tb: Any) -> None:
+        """Cancel and await the background tasks, then close all connections."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        await self.aclose()
+
+    def start_task(self, coroutine: Coroutine[Any, Any, None]) -> None:
+        """Run a background task until the application is stopped."""
+        self._tasks.append(asyncio.ensure_future(coroutine))
+
+    async def run_forever(self) -> None:
+        """Wait until the application is stopped with stop()."""
+        await LOOP.create_future()
+
+    def stop(self) -> None:
+        """Stop the application by cancelling its main task (thread-safe)."""
+        LOOP.call_soon_threadsafe(self._cancel_main_task)
+
+    def _cancel_main_task(self) -> None:
+        """Cancel the main task once, so a repeated stop does not interrupt cleanup."""
+        if self._stop_requested:
+            return
+        self._stop_requested = True
+        if self._main_task is not None:
+            self._main_task.cancel()
+
+    def _on_mqtt_connect(self, client: mqtt.Client, userdata: Any, flags: Any, reason_code: Any, properties: Any) -> None:
+        """Republish all device states after (re)connecting to the MQTT broker.
+
+        Retained states may be gone, e.g. after a broker restart without persistence.
+        """
+        if reason_code.is_failure:
+            return
+        for mqttDevice in self.mqttDevices.values():
+            mqttDevice.forget_published_state()
+            try:
+                mqttDevice.updateNode()
+            except Exception as e:
+                logging.error("Error republishing state for %s: %s", mqttDevice.vlxnode.name, e)
+
+    def _on_mqtt_socket_open(self, client: mqtt.Client, userdata: Any, sock: Any) -> None:
+        """Watch a newly opened MQTT socket for incoming data."""
+        self._call_on_loop(self._update_mqtt_watchers)
+
+    def _on_mqtt_socket_close(self, client: mqtt.Client, userdata: Any, sock: Any) -> None:
+        """Stop watching an MQTT socket that is about to be closed."""
+        self._call_on_loop(self._update_mqtt_watchers)
+
+    def _on_mqtt_socket_write_changed(self, client: mqtt.Client, userdata: Any, sock: Any) -> None:
+        """Handle paho starting or stopping to have data to send."""
+        self._call_on_loop(self._update_mqtt_watchers)
+
+    def _call_on_loop(self, callback: Callable[[], None]) -> None:
+        """Run a socket callback, unless a worker thread owns the client.
+
+        Apart from the (re)connect worker, the client is only used on the
+        event loop thread. Callbacks from the worker are skipped; the
+        watchers are set up from the client's state once it has finished.
+        """
+        if self._mqtt_connecting:
+            return
+        try:
+            in_loop = asyncio.get_running_loop() is LOOP
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            callback()
+        else:
+            LOOP.call_soon_threadsafe(callback)
+
+    def _update_mqtt_watchers(self) -> None:
+        """Watch the MQTT socket for incoming data, and for writability while paho has data to send."""
+        sock = self.mqttc.socket()
+        if sock is not self._mqtt_read_sock:
+            if self._mqtt_read_sock is not None:
+                LOOP.remove_reader(self._mqtt_read_sock)
+            if sock is not None:
+                LOOP.add_reader(sock, self.mqttc.loop_read)
+            self._mqtt_read_sock = sock
+
+        write_sock = sock if sock is not None and self.mqttc.want_write() else None
+        if write_sock is not self._mqtt_write_sock:
+            if self._mqtt_write_sock is not None:
+                LOOP.remove_writer(self._mqtt_write_sock)
+            if write_sock is not None:
+                LOOP.add_writer(write_sock, self.mqttc.loop_write)
+            self._mqtt_write_sock = write_sock
+
+    async def _run_mqtt_connect(self, connect: Callable[..., Any], *args: Any) -> Any:
+        """Run a blocking paho connect or reconnect in a worker thread.
+
+        paho is not thread-safe against its own socket I/O, so while the
+        worker owns the client the loop stops watching its socket and holds
+        back queued publishes. Both resume when the worker has finished,
+        even if the awaiting task was cancelled in the meantime.
+        """
+        self._unwatch_mqtt_socket()
+        pause_publishes()
+        self._mqtt_connecting = True
+        future = LOOP.run_in_executor(None, connect, *args)
+        self._mqtt_connect_future = future
+        future.add_done_callback(self._mqtt_connect_done)
+        return await asyncio.shield(future)
+
+    def _mqtt_connect_done(self, future: "asyncio.Future[Any]") -> None:
+        """Hand the client back to the event loop after a (re)connect."""
+        self._mqtt_connecting = False
+        self._mqtt_connect_future = None
+        self._update_mqtt_watchers()
+        resume_publishes()
+
+    def _unwatch_mqtt_socket(self) -> None:
+        """Stop watching the MQTT socket."""
+        if self._mqtt_read_sock is not None:
+            LOOP.remove_reader(self._mqtt_read_sock)
+            self._mqtt_read_sock = None
+        if self._mqtt_write_sock is not None:
+            LOOP.remove_writer(self._mqtt_write_sock)
+            self._mqtt_write_sock = None
+
+    async def mqtt_misc_task(self) -> None:
+        """Send MQTT keepalives and reconnect after the connection was lost."""
+        while True:
+            await asyncio.sleep(1)
+            if self.mqttc.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+                continue
+
+            logging.warning("Lost connection to MQTT broker, reconnecting")
+            try:
+                # Resolving and connecting blocks, keep it off the event loop
+                await self._run_mqtt_connect(self.mqttc.reconnect)
+            except Exception as e:
+                logging.warning("MQTT reconnect failed: %s", e)
+                await asyncio.sleep(MQTT_RECONNECT_DELAY)
 
     async def connect_mqtt(self, max_retries: int = 10) -> None:
         """Connect to MQTT broker with exponential backoff retry."""
-        logging.debug(f"Connecting to MQTT broker: {MQTT_HOST}:{MQTT_PORT}")
+        logging.debug("Connecting to MQTT broker: %s:%s", MQTT_HOST, MQTT_PORT)
         
         if MQTT_LOGIN:
-            logging.debug(f"  Login: {MQTT_LOGIN}")
+            logging.debug("  Login: %s", MQTT_LOGIN)
             self.mqttc.username_pw_set(MQTT_LOGIN, MQTT_PASSWORD)
 
         for attempt in range(max_retries):
             try:
-                result = self.mqttc.connect(MQTT_HOST, MQTT_PORT, 60)
+                result = await self._run_mqtt_connect(self.mqttc.connect, MQTT_HOST, MQTT_PORT, 60)
                 if result == 0:
-                    self.mqttc.loop_start()
+                    self._mqtt_misc_task = asyncio.ensure_future(self.mqtt_misc_task())
                     await asyncio.sleep(1)
                     logging.info("Connected to MQTT broker")
                     return
                 else:
-                    logging.warning(f"MQTT connection attempt {attempt + 1}: error code {result}")
+                    logging.warning("MQTT connection attempt %s: error code %s", attempt + 1, result)
             except Exception as e:
-                logging.warning(f"MQTT connection attempt {attempt + 1} failed: {e}")
+                logging.warning("MQTT connection attempt %s failed: %s", attempt + 1, e)
             
             if attempt < max_retries - 1:
                 wait_time = 10 * (attempt + 1)  # Exponential backoff
-                logging.info(f"Retrying MQTT connection in {wait_time} seconds")
+                logging.info("Retrying MQTT connection in %s seconds", wait_time)
                 await asyncio.sleep(wait_time)
         
         raise ConnectionError(f"Failed to connect to MQTT after {max_retries} attempts")
 
     async def connect_klf200(self, loop: asyncio.AbstractEventLoop) -> None:
         """Connect to KLF200 gateway."""
-        logging.debug(f"Connecting to KLF200: {VLX_HOST}")
+        logging.debug("Connecting to KLF200: %s", VLX_HOST)
         self.pyvlx = PyVLX(host=VLX_HOST, password=VLX_PW, loop=loop)  # type: ignore[no-untyped-call]
         await self.pyvlx.load_nodes()  # type: ignore[union-attr,no-untyped-call]
-        record_klf_contact()
+        self.last_klf_contact = LOOP.time()
 
-        logging.info(f"Connected to KLF200, found {len(self.pyvlx.nodes)} nodes")  # type: ignore[union-attr]
+        logging.info("Connected to KLF200, found %s nodes", len(self.pyvlx.nodes))  # type: ignore[union-attr]
         for node in self.pyvlx.nodes:  # type: ignore[union-attr]
-            logging.debug(f"  - {node.name}")
+            logging.debug("  - %s", node.name)
+
+    async def connect(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Connect to MQTT broker and KLF200 concurrently.
+
+        If either connection fails, the other attempt is cancelled.
+        """
+        tasks = [
+            asyncio.ensure_future(self.connect_mqtt()),
+            asyncio.ensure_future(self.connect_klf200(loop)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
 
     async def register_devices(self) -> None:
         """Register all VLX devices as MQTT devices."""
@@ -490,69 +706,111 @@ class VeluxMqttHomeassistant:
                 vlxnode.register_device_updated_cb(self.vlxnode_callback)  # type: ignore[no-untyped-call]
                 mqttid = self.generate_id(vlxnode)
                 
-                if isinstance(vlxnode, Awning) and HA_INVERT_AWNING:
-                    cover: VeluxMqttCover = VeluxMqttCoverInverted(self.mqttc, vlxnode, mqttid)
+                if HA_INVERT_AWNING and type(vlxnode) is Awning:
+                    cover: VeluxMqttCover = VeluxMqttCoverInverted(self.mqttc, vlxnode, mqttid, self.submit_command)
                 else:
-                    cover = VeluxMqttCover(self.mqttc, vlxnode, mqttid)
+                    cover = VeluxMqttCover(self.mqttc, vlxnode, mqttid, self.submit_command)
                 
                 self.mqttDevices[mqttid] = cover
+                self.mqttDevicesByNodeId[vlxnode.node_id] = cover
                 await cover.registerMqttCallbacks()
-                logging.debug(f"Watching: {vlxnode.name}")
+                logging.debug("Watching: %s", vlxnode.name)
                 
                 # Initialize target position to current position to ensure valid state
                 # This prevents showing "closing" with an invalid target position
                 try:
                     await vlxnode.stop(wait_for_completion=False)  # type: ignore[no-untyped-call]
                 except Exception as e:
-                    logging.debug(f"Could not initialize {vlxnode.name} with stop: {e}")
+                    logging.debug("Could not initialize %s with stop: %s", vlxnode.name, e)
+
+        # Subscribe to the command topics of all covers at once
+        flush_subscriptions(self.mqttc)
     
+    def submit_command(self, coroutine: Coroutine[Any, Any, Any]) -> None:
+        """Queue a KLF200 command for the command workers."""
+        self._cmd_queue.put_nowait(coroutine)
+
+    async def command_worker(self) -> None:
+        """Execute queued KLF200 commands one after another."""
+        while True:
+            coroutine = await self._cmd_queue.get()
+            try:
+                await asyncio.wait_for(coroutine, KLF_COMMAND_TIMEOUT)
+            except asyncio.TimeoutError:
+                logging.error("KLF200 command timed out after %s seconds", KLF_COMMAND_TIMEOUT)
+            except Exception as e:
+                logging.error("KLF200 command error: %s", e, exc_info=True)
+
     async def update_device_state(self) -> None:
         """Request initial state of all devices."""
         if not self.pyvlx:
             return
-        for vlxnode in self.pyvlx.nodes:  # type: ignore[attr-defined]
-            if isinstance(vlxnode, OpeningDevice):
-                await self.pyvlx.get_limitation(vlxnode.node_id)  # type: ignore[union-attr,no-untyped-call]        
+        pyvlx = self.pyvlx
+        # Query all nodes concurrently, but don't flood the KLF200 with requests
+        semaphore = asyncio.Semaphore(KLF_MAX_CONCURRENT_COMMANDS)
+
+        async def get_limitation(node_id: int) -> None:
+            async with semaphore:
+                await pyvlx.get_limitation(node_id)  # type: ignore[no-untyped-call]
+
+        await asyncio.gather(*(
+            get_limitation(vlxnode.node_id)
+            for vlxnode in pyvlx.nodes  # type: ignore[attr-defined]
+            if isinstance(vlxnode, OpeningDevice)
+        ))
 
     async def vlxnode_callback(self, vlxnode: OpeningDevice) -> None:
         """Handle VLX node state update."""
-        logging.debug(f"{vlxnode.name}: {vlxnode.position.position_percent}%")
-        record_klf_contact()
-        mqttid = self.generate_id(vlxnode)
-        mqttDevice = self.mqttDevices.get(mqttid)
+        logging.debug("%s: %s%%", vlxnode.name, vlxnode.position.position_percent)
+        self.last_klf_contact = LOOP.time()
+        mqttDevice = self.mqttDevicesByNodeId.get(vlxnode.node_id)
         if mqttDevice:
             mqttDevice.updateNode()
 
     def generate_id(self, vlxnode: OpeningDevice) -> str:
         """Generate unique MQTT ID from VLX node name."""
-        umlauts = {ord('ä'): 'ae', ord('ü'): 'ue', ord('ö'): 'oe', ord('ß'): 'ss'}
-        node_name = str(vlxnode.name)  # type: ignore[union-attr]
-        return "vlx-" + node_name.replace(" ", "-").lower().translate(umlauts)
+        return mqttid_from_name(str(vlxnode.name))  # type: ignore[union-attr]
 
     def close(self) -> None:
-        """Properly close all connections."""
+        """Close all connections from outside the running event loop."""
+        if not self._closed and not LOOP.is_closed():
+            LOOP.run_until_complete(self.aclose())
+
+    async def aclose(self) -> None:
+        """Properly close all connections (only the first call has an effect)."""
+        if self._closed:
+            return
+        self._closed = True
+
+        # Wait until a (re)connect in progress has handed the client back
+        if self._mqtt_connect_future is not None:
+            await asyncio.wait({self._mqtt_connect_future})
+
         for device in list(self.mqttDevices.values()):
             try:
                 device.stop()
             except Exception as e:
-                logging.error(f"Error closing device: {e}", exc_info=True)
+                logging.error("Error closing device: %s", e, exc_info=True)
         
         self.mqttDevices.clear()
+        self.mqttDevicesByNodeId.clear()
         
+        if self._mqtt_misc_task:
+            self._mqtt_misc_task.cancel()
         try:
             self.mqttc.disconnect()
-            self.mqttc.loop_stop()
+            # Send the DISCONNECT packet right away instead of waiting for the writer
+            self.mqttc.loop_write()
             logging.info("Disconnected from MQTT broker")
         except Exception as e:
-            logging.error(f"Error disconnecting from MQTT: {e}", exc_info=True)
+            logging.error("Error disconnecting from MQTT: %s", e, exc_info=True)
         
         if self.pyvlx:
             try:
-                if not LOOP.is_closed():
-                    LOOP.run_until_complete(self.pyvlx.disconnect())  # type: ignore[no-untyped-call]
+                await self.pyvlx.disconnect()  # type: ignore[no-untyped-call]
                 logging.info("Disconnected from KLF200")
             except Exception as e:
-                logging.error(f"Error disconnecting from KLF200: {e}", exc_info=True)
+                logging.error("Error disconnecting from KLF200: %s", e, exc_info=True)
 
     def __del__(self) -> None:
         """Cleanup on deletion."""
@@ -563,84 +821,122 @@ class VeluxMqttHomeassistant:
 
 
 async def state_update_task(homeassistant_instance: VeluxMqttHomeassistant) -> None:
-    """Periodically update device states from KLF200."""
-    STATE_UPDATE_INTERVAL = 5  # Update state every 5 seconds
-    
-    logging.info(f"State update task enabled: every {STATE_UPDATE_INTERVAL} seconds")
+    """Periodically refresh device states as a fallback for missed KLF200 updates."""
+    # State changes are published right away from the KLF200 node callbacks
+    if HA_STATE_UPDATE_INTERVAL <= 0:
+        return
+
+    logging.info("State update task enabled: every %s seconds", HA_STATE_UPDATE_INTERVAL)
     
     while True:
         try:
-            await asyncio.sleep(STATE_UPDATE_INTERVAL)
+            await asyncio.sleep(HA_STATE_UPDATE_INTERVAL)
             
-            # Update state for all registered devices
-            for mqttid, mqttDevice in homeassistant_instance.mqttDevices.items():
+            # Republish all devices, including values whose last publish failed
+            for mqttDevice in homeassistant_instance.mqttDevices.values():
+                mqttDevice.forget_published_state()
                 try:
                     mqttDevice.updateNode()
                 except Exception as e:
-                    logging.debug(f"Error updating state for {mqttDevice.vlxnode.name}: {e}")
+                    logging.debug("Error updating state for %s: %s", mqttDevice.vlxnode.name, e)
         except asyncio.CancelledError:
             logging.info("State update task cancelled")
             break
         except Exception as e:
-            logging.error(f"Error in state update task: {e}", exc_info=True)
+            logging.error("Error in state update task: %s", e, exc_info=True)
 
 
-async def health_check_task() -> None:
+async def health_check_task(homeassistant_instance: VeluxMqttHomeassistant) -> None:
     """Periodically check KLF200 health and trigger restart if necessary."""
     if HEALTH_CHECK_INTERVAL <= 0:
         return
     
-    logging.info(f"Health check enabled: every {HEALTH_CHECK_INTERVAL} seconds")
+    logging.info("Health check enabled: every %s seconds", HEALTH_CHECK_INTERVAL)
     
     while True:
         try:
             await asyncio.sleep(HEALTH_CHECK_INTERVAL)
             
-            with state_lock:
-                time_since_contact = time.time() - _last_successful_klf_contact
+            time_since_contact = LOOP.time() - homeassistant_instance.last_klf_contact
             
-            threshold = HEALTH_CHECK_INTERVAL * HEALTH_CHECK_FAILURE_THRESHOLD
-            if time_since_contact > threshold:
+            if time_since_contact > HEALTH_CHECK_MAX_SILENCE:
                 logging.warning(
-                    f"KLF200 health check failed: No contact for {time_since_contact:.0f} seconds "
-                    f"(threshold: {threshold:.0f} seconds)"
+                    "KLF200 health check failed: No contact for %.0f seconds (threshold: %.0f seconds)",
+                    time_since_contact, HEALTH_CHECK_MAX_SILENCE
                 )
                 
                 if RESTART_ON_ERROR:
                     logging.warning("Triggering automatic restart due to health check failure")
-                    trigger_restart()
+                    trigger_restart(homeassistant_instance)
                     break
         except asyncio.CancelledError:
             logging.info("Health check task cancelled")
             break
         except Exception as e:
-            logging.error(f"Error in health check task: {e}", exc_info=True)
+            logging.error("Error in health check task: %s", e, exc_info=True)
 
 
-async def restart_interval_task() -> None:
+async def restart_interval_task(homeassistant_instance: VeluxMqttHomeassistant) -> None:
     """Periodically restart the application."""
     if RESTART_INTERVAL <= 0:
         return
     
     restart_seconds = RESTART_INTERVAL * 3600
-    logging.info(f"Periodic restart enabled: every {RESTART_INTERVAL} hours ({restart_seconds} seconds)")
+    logging.info("Periodic restart enabled: every %s hours (%s seconds)", RESTART_INTERVAL, restart_seconds)
     
     while True:
         try:
             await asyncio.sleep(restart_seconds)
             
-            with state_lock:
-                time_since_last_restart = time.time() - _last_restart_time
+            time_since_last_restart = time.monotonic() - _last_restart_time
             
-            logging.info(f"Triggering periodic restart (uptime: {time_since_last_restart/3600:.1f} hours)")
-            trigger_restart()
+            logging.info("Triggering periodic restart (uptime: %.1f hours)", time_since_last_restart/3600)
+            trigger_restart(homeassistant_instance)
             break
         except asyncio.CancelledError:
             logging.info("Restart interval task cancelled")
             break
         except Exception as e:
-            logging.error(f"Error in restart interval task: {e}", exc_info=True)
+            logging.error("Error in restart interval task: %s", e, exc_info=True)
+
+async def async_main(homeassistant_instance: VeluxMqttHomeassistant) -> int:
+    """Run the application until it is stopped by a signal or a restart.
+
+    Returns:
+        Process exit code
+    """
+    try:
+        async with homeassistant_instance:
+            try:
+                await homeassistant_instance.connect(LOOP)
+            except ConnectionError as e:
+                logging.error("Connection failed: %s", e)
+                return 1
+            await homeassistant_instance.register_devices()
+            await homeassistant_instance.update_device_state()
+
+            # Execute KLF200 commands received via MQTT, at most
+            # KLF_MAX_CONCURRENT_COMMANDS at a time
+            for _ in range(KLF_MAX_CONCURRENT_COMMANDS):
+                homeassistant_instance.start_task(homeassistant_instance.command_worker())
+
+            homeassistant_instance.start_task(health_check_task(homeassistant_instance))
+            homeassistant_instance.start_task(restart_interval_task(homeassistant_instance))
+            homeassistant_instance.start_task(state_update_task(homeassistant_instance))
 
+            if RESTART_INTERVAL > 0:
+                logging.info("Scheduled restart every %s hours", RESTART_INTERVAL)
+            if HEALTH_CHECK_INTERVAL > 0:
+                logging.info("Health check enabled every %s seconds", HEALTH_CHECK_INTERVAL)
+
+            logging.info("Application started successfully, entering main loop")
+            await homeassistant_instance.run_forever()
+    except asyncio.CancelledError:
+        logging.info("Application stopped")
+    return 0
+
+
+@functools.lru_cache(maxsize=None)
 def get_pid_file_path() -> Path:
     """Get platform-appropriate PID file path."""
     if sys.platform == "win32":
@@ -652,24 +948,43 @@ def get_pid_file_path() -> Path:
     return pid_dir / f"{APPNAME}.pid"
 
 
-# Use the signal module to handle signals
-def signal_handler(signum: int, frame: Any) -> None:
-    """Handle termination signals gracefully."""
-    logging.info(f"Received signal {signum}, shutting down")
-    if LOOP:
-        LOOP.stop()
+def remove_pid_file(pid_file: str) -> None:
+    """Remove the PID file if it exists."""
+    try:
+        os.unlink(pid_file)
+    except FileNotFoundError:
+        return
+    except OSError as e:
+        logging.error("Error removing PID file: %s", e)
+        return
+    logging.info("PID file removed")
 
 
-signal.signal(signal.SIGTERM, signal_handler)
-signal.signal(signal.SIGINT, signal_handler)
+def signal_handler(homeassistant_instance: VeluxMqttHomeassistant, signum: int, frame: Any = None) -> None:
+    """Handle termination signals gracefully."""
+    logging.info("Received signal %s, shutting down", signum)
+    homeassistant_instance.stop()
+
 
 if __name__ == '__main__':
     import tempfile
     
-    try:
-        LOOP = asyncio.new_event_loop()
-        asyncio.set_event_loop(LOOP)
+    # Cleanup actions, run in reverse order of registration on exit
+    cleanups: List[Callable[[], None]] = []
+    exit_code = 0
+    
+    # Create the uvloop loop directly instead of installing its policy,
+    # event loop policies are deprecated as of Python 3.14
+    LOOP = uvloop.new_event_loop() if HAS_UVLOOP else asyncio.new_event_loop()
+    asyncio.set_event_loop(LOOP)
+    cleanups.append(LOOP.close)
+    logging.debug("Using event loop %s", type(LOOP).__module__)
+    # Run new tasks synchronously up to their first real suspension (Python 3.12+)
+    eager_task_factory = getattr(asyncio, "eager_task_factory", None)
+    if eager_task_factory is not None:
+        LOOP.set_task_factory(eager_task_factory)
 
+    try:
         pid_file_path = get_pid_file_path()
         
         # Check if already running
@@ -678,7 +993,7 @@ if __name__ == '__main__':
                 existing_pid = int(pid_file_path.read_text().strip())
                 # Check if process is actually running
                 os.kill(existing_pid, 0)
-                logging.error(f"Application already running with PID {existing_pid}")
+                logging.error("Application already running with PID %s", existing_pid)
                 sys.exit(1)
             except (ProcessLookupError, ValueError):
                 # Process not running or invalid PID, remove stale file
@@ -687,66 +1002,43 @@ if __name__ == '__main__':
         # Write PID file
         try:
             pid_file_path.write_text(str(os.getpid()))
-            logging.info(f"PID file created: {pid_file_path}")
+            logging.info("PID file created: %s", pid_file_path)
         except Exception as e:
-            logging.error(f"Failed to write PID file: {e}")
+            logging.error("Failed to write PID file: %s", e)
             sys.exit(1)
+        cleanups.append(functools.partial(remove_pid_file, str(pid_file_path)))
 
         # Initialize application
         veluxMqttHomeassistant = VeluxMqttHomeassistant()
-        health_check_task_obj: Optional[asyncio.Task[None]] = None
-        restart_interval_task_obj: Optional[asyncio.Task[None]] = None
-        state_update_task_obj: Optional[asyncio.Task[None]] = None
-        
-        try:
-            LOOP.run_until_complete(veluxMqttHomeassistant.connect_mqtt())
-            LOOP.run_until_complete(veluxMqttHomeassistant.connect_klf200(LOOP))
-            LOOP.run_until_complete(veluxMqttHomeassistant.register_devices())
-            LOOP.run_until_complete(veluxMqttHomeassistant.update_device_state())
-
-            # Create background tasks for health check and restart interval
-            health_check_task_obj = asyncio.ensure_future(health_check_task())
-            restart_interval_task_obj = asyncio.ensure_future(restart_interval_task())
-            state_update_task_obj = asyncio.ensure_future(state_update_task(veluxMqttHomeassistant))
-
-            if RESTART_INTERVAL > 0:
-                logging.info(f"Scheduled restart every {RESTART_INTERVAL} hours")
-            if HEALTH_CHECK_INTERVAL > 0:
-                logging.info(f"Health check enabled every {HEALTH_CHECK_INTERVAL} seconds")
+        cleanups.append(veluxMqttHomeassistant.close)
 
-            logging.info("Application started successfully, entering main loop")
-            LOOP.run_forever()
-            
-        except ConnectionError as e:
-            logging.error(f"Connection failed: {e}")
-            sys.exit(1)
-        except Exception as e:
-            logging.error(f"Application error: {e}", exc_info=True)
-            sys.exit(1)
-        finally:
-            # Cancel background tasks
-            for task in [health_check_task_obj, restart_interval_task_obj, state_update_task_obj]:
-                if task and not task.done():
-                    task.cancel()
-            
-            # Cleanup
-            try:
-                veluxMqttHomeassistant.close()
-            except Exception as e:
-                logging.error(f"Error during cleanup: {e}", exc_info=True)
-            
-            # Remove PID file
+        # Stop on termination signals, so shutdown runs as normal control flow
+        stop_handler = functools.partial(signal_handler, veluxMqttHomeassistant)
+        for sig in (signal.SIGINT, signal.SIGTERM):
             try:
-                pid_file_path.unlink(missing_ok=True)
-                logging.info("PID file removed")
-            except Exception as e:
-                logging.error(f"Error removing PID file: {e}")
-                
-    except KeyboardInterrupt:
-        logging.info("Interrupted by user")
+                LOOP.add_signal_handler(sig, stop_handler, sig)
+            except NotImplementedError:  # Windows event loops
+                signal.signal(sig, stop_handler)
+
+        exit_code = LOOP.run_until_complete(async_main(veluxMqttHomeassistant))
+        
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        else:
+            exit_code = e.code if isinstance(e.code, int) else 1
     except Exception as e:
-        logging.error(f"Fatal error: {e}", exc_info=True)
-        sys.exit(1)
+        logging.error("Application error: %s", e, exc_info=True)
+        exit_code = 1
     finally:
-        LOOP.close()
-        sys.exit(0)
+        for cleanup in reversed(cleanups):
+            try:
+                cleanup()
+            except Exception as e:
+                logging.error("Error during cleanup: %s\n%s", e, traceback.format_exc())
+
+        # Everything is cleaned up, so flush the logs and exit right away
+        # instead of running the full interpreter shutdown
+        log_listener.stop()
+        logging.shutdown()
+        os._exit(exit_code)